@@ -1,16 +1,31 @@
+import copy
+import functools
+import hashlib
 import json
 import logging
 import re
-from typing import Any, Optional
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+from importlib.util import find_spec
+from typing import Any, Callable, Optional
 
 import gevent
+import gevent.lock
 import requests
-from gql import Client, gql
-from gql.transport.requests import RequestsHTTPTransport
+
+try:
+    # multi-MB subgraph responses parse 2-4x faster with orjson, but it stays optional
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
 
 from rotkehlchen.db.settings import CachedSettings
 from rotkehlchen.errors.misc import RemoteError
 from rotkehlchen.logging import RotkehlchenLogsAdapter
+from rotkehlchen.types import Timestamp
+from rotkehlchen.utils.misc import ts_now
 
 logger = logging.getLogger(__name__)
 log = RotkehlchenLogsAdapter(logger)
@@ -18,8 +33,36 @@ log = RotkehlchenLogsAdapter(logger)
 
 GRAPH_QUERY_LIMIT = 1000
 GRAPH_QUERY_SKIP_LIMIT = 5000
+GRAPH_CACHE_MAX = 128
+GRAPH_CACHE_EXPIRY_SECS = 3600
+# Only queries strictly about the past can be cached. Consider anything that may
+# still see new entries within roughly one block of now as non-historical.
+GRAPH_CACHE_RECENCY_MARGIN = 15
+# Ceiling on concurrent in-flight subgraph requests across all Graph instances.
+# Excess greenlets block on the semaphore instead of opening more sockets and
+# getting 429/503 replies that would only feed the retry/backoff path.
+GRAPH_CONCURRENT_QUERIES = 8
+# Bucket sizes used to round the timestamps of subgraph queries. Identical query
+# strings hit both our own cache and The Graph's shared HTTP caches, so collapse
+# distinct-but-equivalent windows into canonical ones.
+TO_TS_GRANULARITY = 3600  # round to_ts down to the hour
+FROM_TS_GRANULARITY = 86400  # round from_ts down to the day
 RE_MULTIPLE_WHITESPACE = re.compile(r'\s+')
+RE_CACHE_CONTROL_MAX_AGE = re.compile(r'max-age=(\d+)')
 RETRY_BACKOFF_FACTOR = 0.2
+# http status codes for which it makes sense to retry the query: the gateway is
+# either throttling us or having transient trouble. Anything else won't be fixed
+# by asking again.
+RETRY_STATUS_CODES = frozenset([
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+])
+# Subgraph JSON compresses very well (often >5x) so ask for it explicitly.
+# brotli is an optional dependency -- urllib3 only decodes br if it is present.
+ACCEPT_ENCODING = 'gzip, deflate' + (', br' if find_spec('brotli') is not None else '')
 SUBGRAPH_REMOTE_ERROR_MSG = (
     'Failed to request the {protocol} subgraph due to {error_msg}. '
     'All the deposits and withdrawals history queries are not functioning until this is fixed. '  # noqa: E501
@@ -27,25 +70,231 @@ SUBGRAPH_REMOTE_ERROR_MSG = (
 )
 
 
+@functools.lru_cache(maxsize=512)
 def format_query_indentation(querystr: str) -> str:
     """Format a triple quote and indented GraphQL query by:
     - Removing returns
     - Replacing multiple inner whitespaces with one
     - Removing leading and trailing whitespaces
+
+    Memoized since callers pass module-level constant templates, so the regex
+    scan over each multi-KB query string runs once instead of per call.
     """
     return RE_MULTIPLE_WHITESPACE.sub(' ', querystr).strip()
 
 
+@functools.lru_cache(maxsize=4096)
+def lower_address(address: str) -> str:
+    """Return the lower-case form of an address, memoized.
+
+    Checksummed addresses get lower-cased on every query they appear in, often
+    dozens of times per pagination loop; caching hands back one shared string
+    per address instead of a fresh 42-char allocation each call, which also
+    keeps the downstream cache keys canonical.
+    """
+    return address.lower()
+
+
+@functools.lru_cache(maxsize=256)
+def _build_prefix(param_types_items: tuple[tuple[str, str], ...]) -> str:
+    """Build the variable declaration prefix of a query from its param types.
+
+    Memoized since queries come from a small set of constant templates, so the
+    per-call string work only happens once per query shape. The items must be
+    given sorted so that logically equal shapes share a cache entry.
+    """
+    return 'query (' + ', '.join(f'{k}: {v}' for k, v in param_types_items) + '){'
+
+
+def round_query_period(
+        from_ts: Timestamp,
+        to_ts: Timestamp,
+        granularity: int = TO_TS_GRANULARITY,
+) -> tuple[Timestamp, Timestamp]:
+    """Round a subgraph query window to canonical bucket boundaries.
+
+    from_ts is rounded down to the day and to_ts up to the next `granularity`
+    boundary (an hour by default), so the rounded window is a superset of the
+    requested one and no events are lost. All queries within the same bucket
+    then produce identical request strings that can be answered by caches --
+    ours and The Graph's -- instead of originating new requests. Callers that
+    really need finer resolution on the upper bound can pass a smaller
+    granularity.
+    """
+    rounded_from = Timestamp(from_ts - (from_ts % FROM_TS_GRANULARITY))
+    rounded_to = Timestamp(to_ts + (-to_ts % granularity))
+    return rounded_from, rounded_to
+
+
+def _is_historical_query(param_values: Optional[dict[str, Any]]) -> bool:
+    """Determine if a query only concerns data strictly in the past.
+
+    Queries bounded by an end timestamp sufficiently far from now can't see new
+    entries and are thus safe to serve from the cache.
+    """
+    if param_values is None:
+        return False
+
+    end_ts = None
+    for key in ('to_ts', 'end_ts'):
+        if key in param_values:
+            end_ts = param_values[key]
+            break
+
+    if end_ts is None:
+        return False
+
+    try:
+        return int(end_ts) < ts_now() - GRAPH_CACHE_RECENCY_MARGIN
+    except (ValueError, TypeError):
+        return False
+
+
+# One session shared by every Graph instance. rotki creates a distinct Graph per
+# subgraph (Uniswap, AAVE, Balancer, ...) but most of them live behind the same
+# gateway origin, so per-instance pools each held a single cold connection and
+# paid the TCP+TLS handshake on every fresh query. A shared pool keeps warm
+# connections (and TLS session resumption) across all of them.
+_SHARED_SESSION = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(
+    pool_connections=32,  # how many distinct hosts keep a pool around
+    pool_maxsize=GRAPH_CONCURRENT_QUERIES,  # matches the in-flight request ceiling
+    max_retries=0,  # retrying is handled by Graph.query itself
+)
+_SHARED_SESSION.mount('https://', _adapter)
+_SHARED_SESSION.mount('http://', _adapter)
+_SHARED_SESSION.headers.update({'Accept-Encoding': ACCEPT_ENCODING})
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header value into seconds, or None if absent/invalid.
+
+    The header may be either an integer amount of seconds or an HTTP-date.
+    """
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
 class Graph:
 
+    # class-level so that the bound is global: rotki creates one Graph instance
+    # per subgraph but most of them target the same gateway origin
+    _semaphore = gevent.lock.BoundedSemaphore(GRAPH_CONCURRENT_QUERIES)
+
     def __init__(self, url: str) -> None:
+        self.url = url
+        self._cache: OrderedDict[bytes, tuple[int, dict[str, Any]]] = OrderedDict()
+        self._compiled: dict[tuple, Callable[[Optional[dict[str, Any]]], dict[str, Any]]] = {}
+        self._session = _SHARED_SESSION
+
+    def _execute(
+            self,
+            querystr: str,
+            param_values: Optional[dict[str, Any]],
+    ) -> tuple[dict[str, Any], Optional[int]]:
+        """POST a single GraphQL document to the subgraph and return its data
+        along with the cache TTL the gateway advertised via Cache-Control, if any.
+
+        The queries are internally authored and constant so there is no need for
+        the client-side AST parsing/validation a full GraphQL client would do.
+
+        May raise:
+        - requests.RequestException if there is a problem reaching the subgraph
+        - RemoteError if the response is an http error or contains query errors.
+        For retryable http errors the exception carries any server-advertised
+        Retry-After delay in its retry_after attribute.
+        """
+        request_body = {'query': querystr, 'variables': param_values or {}}
+        if orjson is not None:
+            response = self._session.post(
+                self.url,
+                data=orjson.dumps(request_body),
+                headers={'Content-Type': 'application/json'},
+                timeout=CachedSettings().get_timeout_tuple(),
+            )
+        else:
+            response = self._session.post(
+                self.url,
+                json=request_body,
+                timeout=CachedSettings().get_timeout_tuple(),
+            )
+        if response.status_code != HTTPStatus.OK:
+            error = RemoteError(
+                message=f'The Graph replied with HTTP status code {response.status_code}',
+                error_code=response.status_code,
+            )
+            error.retry_after = _parse_retry_after(response.headers.get('Retry-After'))  # type: ignore[attr-defined]  # noqa: E501
+            raise error
+
+        try:  # orjson.JSONDecodeError is a ValueError subclass
+            data = orjson.loads(response.content) if orjson is not None else response.json()
+        except ValueError as e:
+            raise RemoteError('The Graph replied with an invalid JSON response') from e
+
+        if 'errors' in data:
+            raise RemoteError(f'The Graph query returned errors: {data["errors"]}')
+
+        cache_ttl = None
+        match = RE_CACHE_CONTROL_MAX_AGE.search(response.headers.get('Cache-Control', ''))
+        if match is not None:
+            cache_ttl = int(match.group(1))
+
+        query_data = data.get('data')
+        if query_data is None:
+            raise RemoteError('The Graph reply is missing the data key')
+
+        return query_data, cache_ttl
+
+    def _cache_key(self, querystr: str, param_values: Optional[dict[str, Any]]) -> bytes:
+        """Compute a stable cache key for a formatted query and its parameter values.
+
+        Parameter values are canonically serialized (sorted keys, typed json) so that
+        logically equal queries always map to the same key.
+        """
+        return hashlib.blake2b(
+            self.url.encode() +
+            querystr.encode() +
+            json.dumps(param_values, sort_keys=True, default=str).encode(),
+            digest_size=16,
+        ).digest()
+
+    def _cache_get(self, key: bytes) -> Optional[dict[str, Any]]:
+        """Return a copy of the cached result for the given key if fresh, else None"""
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+
+        expires_at, result = entry
+        if ts_now() > expires_at:
+            del self._cache[key]
+            return None
+
+        self._cache.move_to_end(key)
+        return copy.deepcopy(result)
+
+    def _cache_set(self, key: bytes, result: dict[str, Any], ttl: Optional[int] = None) -> None:
+        """Store a query result in the cache, evicting the least recently used entry.
+
+        If the gateway advertised a TTL via Cache-Control it extends (but never
+        shortens below) our default expiry.
         """
-        - May raise requests.RequestException if there is a problem connecting to the subgraph"""
-        transport = RequestsHTTPTransport(url=url)
-        try:
-            self.client = Client(transport=transport, fetch_schema_from_transport=False)
-        except (requests.exceptions.RequestException) as e:
-            raise RemoteError(f'Failed to connect to the graph at {url} due to {e!s}') from e
+        effective_ttl = max(GRAPH_CACHE_EXPIRY_SECS, ttl) if ttl is not None else GRAPH_CACHE_EXPIRY_SECS  # noqa: E501
+        self._cache[key] = (ts_now() + effective_ttl, copy.deepcopy(result))
+        self._cache.move_to_end(key)
+        if len(self._cache) > GRAPH_CACHE_MAX:
+            self._cache.popitem(last=False)
 
     def query(
             self,
@@ -61,29 +310,60 @@ class Graph:
         """
         prefix = ''
         if param_types is not None:
-            prefix = 'query '
-            prefix += json.dumps(param_types).replace('"', '').replace('{', '(').replace('}', ')')
-            prefix += '{'
+            prefix = _build_prefix(tuple(sorted(param_types.items())))
 
         querystr = prefix + querystr
         log.debug(f'Querying The Graph for {querystr}')
 
+        cache_key = None
+        if _is_historical_query(param_values):
+            cache_key = self._cache_key(querystr=querystr, param_values=param_values)
+            cached_result = self._cache_get(cache_key)
+            if cached_result is not None:
+                log.debug('Returning The Graph query result from the cache')
+                return cached_result
+
+        result, cache_ttl = self._query_with_retries(querystr, param_values)
+        log.debug('Got result from The Graph query')
+        if cache_key is not None:
+            self._cache_set(cache_key, result, ttl=cache_ttl)
+        return result
+
+    def _query_with_retries(
+            self,
+            querystr: str,
+            param_values: Optional[dict[str, Any]],
+    ) -> tuple[dict[str, Any], Optional[int]]:
+        """Execute a fully formatted query document with the retry/backoff logic.
+
+        May raise:
+        - RemoteError: If there is a problem querying the subgraph and there
+        are no retries left.
+        """
         retries_left = CachedSettings().get_query_retry_limit()
         while retries_left > 0:
             try:
-                result = self.client.execute(gql(querystr), variable_values=param_values)
-            # need to catch Exception here due to stupidity of gql library
-            except (requests.exceptions.RequestException, Exception) as e:  # pylint: disable=broad-except  # noqa: E501
-                # NB: the lack of a good API error handling by The Graph combined
-                # with gql v2 raising bare exceptions doesn't allow us to act
-                # better on failed requests. Currently all trigger the retry logic.
-                # TODO: upgrade to gql v3 and amend this code on any improvement
-                # The Graph does on its API error handling.
+                # gate through the semaphore so bursts are smoothed instead of erroring
+                with self._semaphore:
+                    result, cache_ttl = self._execute(querystr, param_values)
+            except (requests.exceptions.RequestException, RemoteError) as e:
+                if isinstance(e, RemoteError) and e.error_code not in RETRY_STATUS_CODES:
+                    # a definitive reply: malformed response or query errors. Retrying
+                    # the exact same query can't make those go away.
+                    raise RemoteError(
+                        f'The Graph query to {querystr} failed due to {e!s}',
+                    ) from e
+
                 exc_msg = str(e)
                 retries_left -= 1
                 base_msg = f'The Graph query to {querystr} failed due to {exc_msg}'
                 if retries_left:
-                    sleep_seconds = RETRY_BACKOFF_FACTOR * pow(2, CachedSettings().get_query_retry_limit() - retries_left)  # noqa: E501
+                    # prefer the server-advertised delay over the exponential guess
+                    retry_after = getattr(e, 'retry_after', None)
+                    if retry_after is not None:
+                        sleep_seconds = retry_after
+                    else:
+                        sleep_seconds = RETRY_BACKOFF_FACTOR * pow(2, CachedSettings().get_query_retry_limit() - retries_left)  # noqa: E501
                     retry_msg = (
                         f'Retrying query after {sleep_seconds} seconds. '
                         f'Retries left: {retries_left}.'
@@ -95,5 +375,195 @@ class Graph:
             else:
                 break
 
-        log.debug('Got result from The Graph query')
-        return result
+        return result, cache_ttl
+
+    def compile(
+            self,
+            querystr: str,
+            param_types: Optional[dict[str, Any]] = None,
+    ) -> Callable[[Optional[dict[str, Any]]], dict[str, Any]]:
+        """Specialize query() for a constant template, returning a callable of
+        only the param values.
+
+        The variable declaration prefix is joined and the cache-key hash is
+        seeded with the url and the full document once at compile time, so the
+        per-call work of hot pagination/polling loops reduces to hashing the
+        param values and the request itself. Compiled callables are memoized per
+        (querystr, param_types) pair and share the result cache with query().
+
+        The returned callable may raise:
+        - RemoteError: If there is a problem querying the subgraph and there
+        are no retries left.
+        """
+        types_key = tuple(sorted(param_types.items())) if param_types is not None else None
+        compile_key = (querystr, types_key)
+        compiled = self._compiled.get(compile_key)
+        if compiled is not None:
+            return compiled
+
+        prefix = _build_prefix(types_key) if types_key is not None else ''
+        full_querystr = prefix + querystr
+        # blake2b over a concatenation equals streaming updates, so seeding with
+        # url + document yields the same digests as _cache_key
+        base_hash = hashlib.blake2b(
+            self.url.encode() + full_querystr.encode(),
+            digest_size=16,
+        )
+
+        def run(param_values: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+            log.debug(f'Querying The Graph for compiled {full_querystr}')
+            cache_key = None
+            if _is_historical_query(param_values):
+                hasher = base_hash.copy()
+                hasher.update(json.dumps(param_values, sort_keys=True, default=str).encode())
+                cache_key = hasher.digest()
+                cached_result = self._cache_get(cache_key)
+                if cached_result is not None:
+                    log.debug('Returning The Graph query result from the cache')
+                    return cached_result
+
+            result, cache_ttl = self._query_with_retries(full_querystr, param_values)
+            if cache_key is not None:
+                self._cache_set(cache_key, result, ttl=cache_ttl)
+            return result
+
+        self._compiled[compile_key] = run
+        return run
+
+    def paginate(
+            self,
+            querystr: str,
+            entity_name: str,
+            param_types: Optional[dict[str, Any]] = None,
+            param_values: Optional[dict[str, Any]] = None,
+            page_size: int = GRAPH_QUERY_LIMIT,
+    ) -> list[dict[str, Any]]:
+        """Query all pages of entity_name rows using keyset pagination on id.
+
+        The query template must declare a `$last_id: ID!` variable, filter with
+        `where: {id_gt: $last_id}` and order by id ascending. The Graph warns
+        that `skip`-based offsets cost O(skip) on the backend and degrade
+        markedly past GRAPH_QUERY_SKIP_LIMIT, while an id_gt seek stays an index
+        lookup no matter how deep the pagination goes.
+
+        May raise:
+        - RemoteError: If there is a problem querying the subgraph and there
+        are no retries left.
+        """
+        param_types = {**(param_types or {}), '$last_id': 'ID!'}
+        param_values = {**(param_values or {}), 'last_id': ''}
+        rows: list[dict[str, Any]] = []
+        while True:
+            result = self.query(
+                querystr=querystr,
+                param_types=param_types,
+                param_values=param_values,
+            )
+            page = result[entity_name]
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+
+            param_values = {**param_values, 'last_id': page[-1]['id']}
+
+    def query_many(
+            self,
+            queries: list[tuple[str, Optional[dict[str, Any]], Optional[dict[str, Any]]]],
+    ) -> list[dict[str, Any]]:
+        """Run multiple independent queries concurrently, returning results in order.
+
+        Each entry is a (querystr, param_types, param_values) tuple as would be
+        given to query(). One greenlet is spawned per query but the actual
+        requests are still gated through the shared semaphore, so in-flight
+        sockets stay bounded no matter how many queries are given. Unlike
+        query_batch() each query remains its own HTTP request, which lets
+        individual ones be answered from the cache and keeps response payloads
+        separate.
+
+        May raise:
+        - RemoteError: If any of the queries fails with no retries left.
+        """
+        def run_one(
+                querystr: str,
+                param_types: Optional[dict[str, Any]],
+                param_values: Optional[dict[str, Any]],
+        ) -> Any:
+            # catch inside the greenlet: a greenlet dying with an exception gets
+            # reported by gevent's hub as a raw traceback on stderr before get()
+            # can re-raise it, so return the error and re-raise it in the caller
+            try:
+                return self.query(querystr, param_types, param_values)
+            except RemoteError as e:
+                return e
+
+        greenlets = [gevent.spawn(run_one, *query_args) for query_args in queries]
+        gevent.joinall(greenlets)
+        results = []
+        for greenlet in greenlets:
+            result = greenlet.get()
+            if isinstance(result, RemoteError):
+                raise result
+            results.append(result)
+
+        return results
+
+    def query_batch(
+            self,
+            queries: list[tuple[str, Optional[dict[str, Any]], Optional[dict[str, Any]]]],
+    ) -> list[dict[str, Any]]:
+        """Combine multiple queries into a single aliased GraphQL request.
+
+        Each entry is a (querystr, param_types, param_values) tuple as would be
+        given to query(). That means entries with param types carry the closing
+        brace of their would-be document, while entries without them are
+        complete documents (optionally starting with the query keyword) and get
+        their outer braces stripped here. The sub-queries are merged into one
+        document under aliases q0, q1, ... with their variables prefixed
+        accordingly to avoid collisions, so a single HTTP round trip amortizes
+        the per-request overhead across all of them. Returns one result dict
+        per sub-query, in the same shape query() would have returned for it.
+
+        May raise:
+        - RemoteError: If there is a problem querying the subgraph and there
+        are no retries left.
+        """
+        merged_types: dict[str, Any] = {}
+        merged_values: dict[str, Any] = {}
+        aliased_bodies = []
+        field_names = []
+        for idx, (querystr, param_types, param_values) in enumerate(queries):
+            body = querystr.strip()
+            if param_types is not None:
+                # the body carries the closing brace of its would-be document
+                body = body.removesuffix('}')
+            else:
+                # a complete document: strip the operation keyword and outer braces
+                body = body.removeprefix('query').strip()
+                if body.startswith('{') and body.endswith('}'):
+                    body = body[1:-1].strip()
+
+            match = re.match(r'\s*(\w+)', body)
+            field_names.append(match.group(1) if match is not None else f'q{idx}')
+            for name, type_str in (param_types or {}).items():
+                stripped_name = name.lstrip('$')
+                merged_types[f'$q{idx}_{stripped_name}'] = type_str
+                body = re.sub(rf'\${stripped_name}\b', f'$q{idx}_{stripped_name}', body)
+            for name, value in (param_values or {}).items():
+                merged_values[f'q{idx}_{name}'] = value
+
+            aliased_bodies.append(f'q{idx}: {body}')
+
+        joined_bodies = ' '.join(aliased_bodies)
+        if len(merged_types) != 0:
+            # the variable declaration prefix built by query() opens the document
+            result = self.query(
+                querystr=joined_bodies + '}',
+                param_types=merged_types,
+                param_values=merged_values if len(merged_values) != 0 else None,
+            )
+        else:
+            result = self.query(querystr='{' + joined_bodies + '}')
+        return [
+            {field_names[idx]: result[f'q{idx}']}
+            for idx in range(len(queries))
+        ]
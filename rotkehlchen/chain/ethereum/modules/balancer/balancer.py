@@ -14,6 +14,8 @@ from rotkehlchen.chain.ethereum.graph import (
     SUBGRAPH_REMOTE_ERROR_MSG,
     Graph,
     format_query_indentation,
+    lower_address,
+    round_query_period,
 )
 from rotkehlchen.constants.misc import ZERO, ZERO_PRICE
 from rotkehlchen.constants.resolver import ethaddress_to_identifier
@@ -172,7 +174,7 @@ class Balancer(EthereumModule):
 
         May raise RemoteError
         """
-        addresses_lower = [address.lower() for address in addresses]
+        addresses_lower = [lower_address(address) for address in addresses]
         querystr: str
         schema: Literal['mints', 'burns']
         if event_type == BalancerBPTEventType.MINT:
@@ -339,7 +341,7 @@ class Balancer(EthereumModule):
 
         May raise RemoteError
         """
-        addresses_lower = [address.lower() for address in addresses]
+        addresses_lower = [lower_address(address) for address in addresses]
         querystr: str
         schema: Literal['addLiquidities', 'removeLiquidities']
         mint_or_burn_type: BalancerBPTEventType
@@ -354,7 +356,10 @@ class Balancer(EthereumModule):
         else:
             raise AssertionError(f'Unexpected event type: {event_type}.')
 
-        query_start_ts = start_ts
+        # round to canonical buckets (a superset of the requested window) so
+        # repeated queries within the same bucket produce identical request
+        # strings and hit the caches instead of the subgraph
+        query_start_ts, query_end_ts = round_query_period(start_ts, end_ts)
         query_offset = 0
         param_types = {
             '$limit': 'Int!',
@@ -368,7 +373,7 @@ class Balancer(EthereumModule):
             'offset': query_offset,
             'addresses': addresses_lower,
             'start_ts': query_start_ts,
-            'end_ts': end_ts,
+            'end_ts': query_end_ts,
         }
         address_to_unique_invest_events: DDAddressToUniqueInvestEvents = defaultdict(set)
         while True:
@@ -395,15 +400,26 @@ class Balancer(EthereumModule):
                 )
                 raise RemoteError('Failed to deserialize balancer events') from e
 
+            # the queried window is widened to bucket boundaries, so drop the
+            # events outside the actually requested range before processing
+            raw_events_in_range = []
+            for raw_event in raw_events:
+                try:
+                    in_range = start_ts <= int(raw_event['timestamp']) <= end_ts
+                except (KeyError, ValueError):
+                    in_range = True  # let deserialization report the problem below
+                if in_range:
+                    raw_events_in_range.append(raw_event)
+
             # first do a run to gather all transaction hashes. We need it to get all pool data
-            mint_or_burn_transactions = {deserialize_transaction_id(x['id'])[0].hex() for x in raw_events}  # noqa: E501 pylint: disable=no-member
+            mint_or_burn_transactions = {deserialize_transaction_id(x['id'])[0].hex() for x in raw_events_in_range}  # noqa: E501 pylint: disable=no-member
             address_to_mint_events = self._get_address_to_bpt_events_graph(
                 addresses=addresses,
                 transactions=list(mint_or_burn_transactions),
                 event_type=mint_or_burn_type,
             )
 
-            for raw_event in raw_events:
+            for raw_event in raw_events_in_range:
                 try:
                     invest_event = deserialize_invest_event(raw_event, event_type=event_type)
                 except DeserializationError as e:
@@ -423,7 +439,9 @@ class Balancer(EthereumModule):
                 break
 
             if query_offset == GRAPH_QUERY_SKIP_LIMIT:
-                query_start_ts = invest_event.timestamp
+                # continue from the last returned event, which may have been
+                # filtered out above as past the requested range
+                query_start_ts = Timestamp(int(raw_events[-1]['timestamp']))
                 query_offset = 0
             else:
                 query_offset += GRAPH_QUERY_LIMIT
@@ -726,7 +744,7 @@ class Balancer(EthereumModule):
         """
         known_tokens: set[EvmToken] = set()
         unknown_tokens: set[EvmToken] = set()
-        addresses_lower = [address.lower() for address in addresses]
+        addresses_lower = [lower_address(address) for address in addresses]
         querystr = format_query_indentation(POOLSHARES_QUERY.format())
         query_offset = 0
         param_types = {
@@ -810,7 +828,9 @@ class Balancer(EthereumModule):
 
         May raise RemoteError
         """
-        unknown_token_addresses_lower = [address.lower() for address in unknown_token_addresses]
+        unknown_token_addresses_lower = [
+            lower_address(address) for address in unknown_token_addresses
+        ]
         querystr = format_query_indentation(TOKENPRICES_QUERY.format())
         query_offset = 0
         param_types = {
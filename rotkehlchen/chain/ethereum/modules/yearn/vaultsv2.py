@@ -6,7 +6,7 @@ from gevent.lock import Semaphore
 
 from rotkehlchen.accounting.structures.balance import Balance, BalanceSheet
 from rotkehlchen.assets.asset import Asset, EvmToken
-from rotkehlchen.chain.ethereum.graph import SUBGRAPH_REMOTE_ERROR_MSG
+from rotkehlchen.chain.ethereum.graph import SUBGRAPH_REMOTE_ERROR_MSG, lower_address
 from rotkehlchen.chain.evm.constants import MAX_BLOCKTIME_CACHE
 from rotkehlchen.constants.misc import EXP18, ZERO
 from rotkehlchen.constants.resolver import ethaddress_to_identifier
@@ -211,7 +211,7 @@ class YearnVaultsV2(EthereumModule):
                 )
             skip_query = last_query and to_block - last_query[1] < MAX_BLOCKTIME_CACHE
             if not skip_query:
-                query_addresses.append(EvmAddress(address.lower()))
+                query_addresses.append(EvmAddress(lower_address(address)))
                 query_checksumed_addresses.append(address)
 
         # if None of the addresses has yearn v2 positions this
@@ -93,7 +93,10 @@ class EventDecoderFunction(Protocol):
 class DecodingRules:
     address_mappings: dict[ChecksumEvmAddress, tuple[Any, ...]]
     event_rules: list[EventDecoderFunction]
-    input_data_rules: dict[bytes, dict[bytes, Callable]]
+    # keyed by the 4-byte function selector and the event topic as big-endian
+    # integers: decoders return bytes keys but they get converted at collection
+    # time since small int hashing is cheaper than hashing a bytes blob per log
+    input_data_rules: dict[int, dict[int, Callable]]
     token_enricher_rules: list[Callable]  # enrichers to run for token transfers
     # rules to run after the main decoding loop. post_decoding_rules is a mapping of
     # counterparties to tuples of the rules that need to be executed.
@@ -214,7 +217,13 @@ class EVMTransactionDecoder(metaclass=ABCMeta):
             )
             return
 
-        new_input_data_rules = self.decoders[class_name].decoding_by_input_data()
+        new_input_data_rules = {
+            int.from_bytes(selector, 'big'): {
+                int.from_bytes(topic, 'big'): callback
+                for topic, callback in topic_rules.items()
+            }
+            for selector, topic_rules in self.decoders[class_name].decoding_by_input_data().items()
+        }
         intersection = set(new_input_data_rules).intersection(set(rules.input_data_rules))
         if len(intersection) != 0:
             raise ValueError(f'Input data duplicates found in decoding rules for {intersection}')
@@ -324,10 +333,10 @@ class EVMTransactionDecoder(metaclass=ABCMeta):
         Execute event rules for the current tx log. Returns None when no
         new event or actions need to be propagated.
         """
-        for rule in self.rules.event_rules:
-            if len(tx_log.topics) == 0:
-                continue  # ignore anonymous events
+        if len(tx_log.topics) == 0:
+            return None  # ignore anonymous events
 
+        for rule in self.rules.event_rules:
             try:
                 decoding_output = rule(token=token, tx_log=tx_log, transaction=transaction, decoded_events=decoded_events, action_items=action_items, all_logs=all_logs)  # noqa: E501
             except (DeserializationError, IndexError) as e:
@@ -348,6 +357,7 @@ class EVMTransactionDecoder(metaclass=ABCMeta):
         - ConversionError
         - UnknownAsset
         """
+        # single dict probe rejects the vast majority of log addresses right away
         mapping_result = self.rules.address_mappings.get(context.tx_log.address)
         if mapping_result is None:
             return DEFAULT_DECODING_OUTPUT
@@ -420,9 +430,13 @@ class EVMTransactionDecoder(metaclass=ABCMeta):
         counterparties = set()
         refresh_balances = False
 
-        # Check if any rules should run due to the 4bytes signature of the input data
-        fourbytes = transaction.input_data[:4]
-        input_data_rules = self.rules.input_data_rules.get(fourbytes)
+        # Check if any rules should run due to the 4bytes signature of the input data.
+        # Guard the length so inputs shorter than a selector (e.g. plain transfers)
+        # can't collide with a zero-padded low selector like 0x00000000.
+        input_data_rules = None
+        if len(transaction.input_data) >= 4:
+            fourbytes = int.from_bytes(transaction.input_data[:4], 'big')
+            input_data_rules = self.rules.input_data_rules.get(fourbytes)
 
         # decode transaction logs from the receipt
         for tx_log in tx_receipt.logs:
@@ -433,7 +447,7 @@ class EVMTransactionDecoder(metaclass=ABCMeta):
                 all_logs=tx_receipt.logs,
                 action_items=action_items,
             )
-            if input_data_rules and len(tx_log.topics) != 0 and (input_rule := input_data_rules.get(tx_log.topics[0])) is not None:  # noqa: E501
+            if input_data_rules and len(tx_log.topics) != 0 and (input_rule := input_data_rules.get(int.from_bytes(tx_log.topics[0], 'big'))) is not None:  # noqa: E501
                 try:  # run specific decoder if the 4bytes signature + topic match
                     result = input_rule(context)
                 except (DeserializationError, ConversionError, UnknownAsset) as e:
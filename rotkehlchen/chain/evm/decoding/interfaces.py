@@ -1,3 +1,5 @@
+import functools
+import sys
 from abc import ABCMeta, abstractmethod
 from collections.abc import Mapping
 from typing import TYPE_CHECKING, Any, Callable, Optional
@@ -13,9 +15,74 @@ if TYPE_CHECKING:
 
     from .base import BaseDecoderTools
 
+# The methods returning the dispatch tables of a decoder. They are queried by the
+# transaction decoder on hot paths but their returns are constant per instance,
+# so their first-call result is cached by __init_subclass__ below.
+DISPATCH_TABLE_METHODS = (
+    'addresses_to_decoders',
+    'decoding_rules',
+    'decoding_by_input_data',
+    'enricher_rules',
+    'post_decoding_rules',
+    'addresses_to_counterparties',
+    'possible_events',
+    'possible_products',
+)
+
+
+# the dispatch tables that are keyed by evm addresses and whose keys thus go
+# through the interning table below
+ADDRESS_KEYED_TABLES = ('addresses_to_decoders', 'addresses_to_counterparties')
+
+_ADDR_INTERN: dict[str, str] = {}
+
+
+def intern_addr(address: ChecksumEvmAddress) -> ChecksumEvmAddress:
+    """Return a canonical interned instance of the given address string
+
+    The same addresses (WETH, USDC, routers ...) appear as dict keys across many
+    decoders, each a separately allocated 42-char string. Sharing one object per
+    address shrinks the resident set and lets dict probes short-circuit on the
+    pointer comparison of equal keys.
+    """
+    return _ADDR_INTERN.setdefault(address, sys.intern(address))  # type: ignore[arg-type, return-value]  # noqa: E501
+
+
+def _cached_table(method: Callable) -> Callable:
+    """Wrap a dispatch-table method to cache its first-call return on the instance
+
+    The orchestrating decoder then always receives the same objects instead of
+    freshly allocated dicts/lists on every invocation. Address-keyed tables get
+    their keys interned while being cached.
+    """
+    @functools.wraps(method)
+    def wrapper(self: 'DecoderInterface') -> Any:
+        try:
+            cache = self._dispatch_tables_cache
+        except AttributeError:
+            cache = self._dispatch_tables_cache = {}  # pylint: disable=attribute-defined-outside-init  # noqa: E501
+
+        if method.__name__ not in cache:
+            result = method(self)
+            if method.__name__ in ADDRESS_KEYED_TABLES:
+                result = {intern_addr(address): value for address, value in result.items()}
+            cache[method.__name__] = result
+        return cache[method.__name__]
+
+    wrapper._table_cached = True  # type: ignore[attr-defined]
+    return wrapper
+
 
 class DecoderInterface(metaclass=ABCMeta):
 
+    # constant template so error storms during decoding reloads only pay for the
+    # final .format() substitution instead of rebuilding the message f-string
+    _NOTIFY_FMT = (
+        'Could not identify asset {asset} decoding ethereum event in {counterparty}. '
+        'Make sure that it has all the required properties (name, symbol and decimals) and '
+        'try to decode the event again {tx_hash}.'
+    )
+
     def __init__(
             self,
             evm_inquirer: 'EvmNodeInquirer',
@@ -27,6 +94,27 @@ class DecoderInterface(metaclass=ABCMeta):
         self.msg_aggregator = msg_aggregator
         self.evm_inquirer = evm_inquirer
 
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        """Cache the dispatch tables of all subclasses on first call
+
+        The tables are constant for the lifetime of a decoder instance.
+        Reloadable decoders propagate new mappings through reload_data() so
+        caching here does not affect them.
+        """
+        super().__init_subclass__(**kwargs)
+        for name in DISPATCH_TABLE_METHODS:
+            method = cls.__dict__.get(name)
+            if method is None:
+                continue
+
+            if isinstance(method, staticmethod):
+                if getattr(method.__func__, '_table_cached', False) is False:
+                    cached_func = functools.lru_cache(maxsize=1)(method.__func__)
+                    cached_func._table_cached = True  # type: ignore[attr-defined]
+                    setattr(cls, name, staticmethod(cached_func))
+            elif getattr(method, '_table_cached', False) is False:
+                setattr(cls, name, _cached_table(method))
+
     def addresses_to_decoders(self) -> dict[ChecksumEvmAddress, tuple[Any, ...]]:
         """Subclasses may implement this to return the mappings of addresses to decode functions"""
         return {}
@@ -89,11 +177,11 @@ class DecoderInterface(metaclass=ABCMeta):
         moment it doesn't take any error type but in the future it could be added if needed.
         Related issue: https://github.com/rotki/rotki/issues/4965
         """
-        self.msg_aggregator.add_error(
-            f'Could not identify asset {event.asset} decoding ethereum event in {counterparty}. '
-            f'Make sure that it has all the required properties (name, symbol and decimals) and '
-            f'try to decode the event again {event.tx_hash.hex()}.',
-        )
+        self.msg_aggregator.add_error(self._NOTIFY_FMT.format(
+            asset=event.asset,
+            counterparty=counterparty,
+            tx_hash=event.tx_hash.hex(),
+        ))
 
     def possible_events(self) -> DecoderEventMappingType:
         """Return the possible event types and subtypes used in the specific decoder"""
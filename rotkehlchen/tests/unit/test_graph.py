@@ -1,11 +1,19 @@
+import json
 from contextlib import ExitStack
+from http import HTTPStatus
 from unittest.mock import MagicMock, patch
 
 import pytest
+import requests
 
-from rotkehlchen.chain.ethereum.graph import Graph, format_query_indentation
+from rotkehlchen.chain.ethereum.graph import (
+    Graph,
+    format_query_indentation,
+    round_query_period,
+)
 from rotkehlchen.db.settings import CachedSettings
 from rotkehlchen.errors.misc import RemoteError
+from rotkehlchen.types import Timestamp
 
 TEST_URL_1 = 'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v2'
 TEST_QUERY_1 = (
@@ -24,26 +32,54 @@ TEST_QUERY_1 = (
 )
 
 
+def _mock_response(data):
+    """Create a successful subgraph response containing the given data"""
+    response = MagicMock()
+    response.status_code = HTTPStatus.OK
+    response.headers = {}
+    response.content = json.dumps({'data': data}).encode()
+    response.json.return_value = {'data': data}
+    return response
+
+
+def test_round_query_period():
+    """Test that query windows are widened to canonical bucket boundaries"""
+    rounded_from, rounded_to = round_query_period(
+        from_ts=Timestamp(1600003601),
+        to_ts=Timestamp(1600003601),
+    )
+    assert rounded_from == Timestamp(1599955200)  # down to the day
+    assert rounded_to == Timestamp(1600005600)  # up to the next hour
+    assert rounded_from <= 1600003601 <= rounded_to
+
+    # timestamps already on a boundary stay untouched
+    rounded_from, rounded_to = round_query_period(
+        from_ts=Timestamp(1599955200),
+        to_ts=Timestamp(1600005600),
+    )
+    assert (rounded_from, rounded_to) == (Timestamp(1599955200), Timestamp(1600005600))
+
+
 def test_exception_retries():
-    """Test an exception raised by Client.execute() triggers the retry logic.
+    """Test an exception raised during the request triggers the retry logic.
     """
     graph = Graph(TEST_URL_1)
     param_types = {'$limit': 'Int!'}
     param_values = {'limit': 1}
     querystr = format_query_indentation(TEST_QUERY_1.format())
 
-    client = MagicMock()
-    client.execute.side_effect = Exception('any message')
+    session = MagicMock()
+    session.post.side_effect = requests.exceptions.ConnectionError('any message')
 
     backoff_factor_patch = patch(
         'rotkehlchen.chain.ethereum.graph.RETRY_BACKOFF_FACTOR',
         new=0,
     )
-    client_patch = patch.object(graph, 'client', new=client)
+    session_patch = patch.object(graph, '_session', new=session)
 
     with ExitStack() as stack:
         stack.enter_context(backoff_factor_patch)
-        stack.enter_context(client_patch)
+        stack.enter_context(session_patch)
         with pytest.raises(RemoteError) as e:
             graph.query(
                 querystr=querystr,
@@ -51,38 +87,224 @@ def test_exception_retries():
                 param_values=param_values,
             )
 
-    assert client.execute.call_count == CachedSettings().get_query_retry_limit()
+    assert session.post.call_count == CachedSettings().get_query_retry_limit()
     assert 'No retries left' in str(e.value)
 
 
+def test_retry_decision_by_status_code():
+    """Test that transient http errors are retried while definitive replies
+    (e.g. a bad request or a graphql error payload) fail immediately.
+    """
+    graph = Graph(TEST_URL_1)
+    querystr = format_query_indentation(TEST_QUERY_1.format())
+
+    error_response = MagicMock()
+    error_response.status_code = HTTPStatus.SERVICE_UNAVAILABLE
+    error_response.headers = {}
+    session = MagicMock()
+    session.post.return_value = error_response
+
+    with ExitStack() as stack:
+        stack.enter_context(
+            patch('rotkehlchen.chain.ethereum.graph.RETRY_BACKOFF_FACTOR', new=0),
+        )
+        stack.enter_context(patch.object(graph, '_session', new=session))
+        with pytest.raises(RemoteError):
+            graph.query(querystr=querystr, param_types={'$limit': 'Int!'}, param_values={'limit': 1})  # noqa: E501
+
+        assert session.post.call_count == CachedSettings().get_query_retry_limit()
+
+        error_response.status_code = HTTPStatus.BAD_REQUEST
+        session.post.reset_mock()
+        with pytest.raises(RemoteError):
+            graph.query(querystr=querystr, param_types={'$limit': 'Int!'}, param_values={'limit': 1})  # noqa: E501
+
+        assert session.post.call_count == 1  # no retries for a definitive reply
+
+
 def test_success_result():
     """Test a successful response returns result as expected and does not
     triggers the retry logic.
     """
-    expected_result = {'schema': [{'data1'}, {'data2'}]}
+    expected_result = {'schema': [{'id': 'data1'}, {'id': 'data2'}]}
 
     graph = Graph(TEST_URL_1)
     param_types = {'$limit': 'Int!'}
     param_values = {'limit': 1}
     querystr = format_query_indentation(TEST_QUERY_1.format())
 
-    client = MagicMock()
-    client.execute.return_value = expected_result
+    session = MagicMock()
+    session.post.return_value = _mock_response(expected_result)
 
     backoff_factor_patch = patch(
         'rotkehlchen.chain.ethereum.graph.RETRY_BACKOFF_FACTOR',
         return_value=0,
     )
-    client_patch = patch.object(graph, 'client', new=client)
+    session_patch = patch.object(graph, '_session', new=session)
 
     with ExitStack() as stack:
         stack.enter_context(backoff_factor_patch)
-        stack.enter_context(client_patch)
+        stack.enter_context(session_patch)
+        result = graph.query(
+            querystr=querystr,
+            param_types=param_types,
+            param_values=param_values,
+        )
+
+    assert session.post.call_count == 1
+    assert result == expected_result
+
+
+def test_historical_query_is_cached():
+    """Test that a historical query (bounded by a past to_ts) is served from
+    the cache on repetition while a query about the present is not.
+    """
+    expected_result = {'schema': [{'id': 'data1'}, {'id': 'data2'}]}
+
+    graph = Graph(TEST_URL_1)
+    param_types = {'$limit': 'Int!', '$to_ts': 'Int!'}
+    param_values = {'limit': 1, 'to_ts': 1600000000}
+    querystr = format_query_indentation(TEST_QUERY_1.format())
+
+    session = MagicMock()
+    session.post.return_value = _mock_response(expected_result)
+
+    with patch.object(graph, '_session', new=session):
+        for _ in range(2):
+            result = graph.query(
+                querystr=querystr,
+                param_types=param_types,
+                param_values=param_values,
+            )
+            assert result == expected_result
+
+        assert session.post.call_count == 1  # second query came from the cache
+
+        # now query without a historical bound and see the cache is not used
+        for _ in range(2):
+            graph.query(
+                querystr=querystr,
+                param_types={'$limit': 'Int!'},
+                param_values={'limit': 1},
+            )
+
+        assert session.post.call_count == 3
+
+
+def test_compiled_query_shares_cache():
+    """Test that compile() memoizes per template and that a compiled call
+    populates the same cache that plain query() reads from.
+    """
+    expected_result = {'schema': [{'id': 'data1'}]}
+
+    graph = Graph(TEST_URL_1)
+    param_types = {'$limit': 'Int!', '$to_ts': 'Int!'}
+    param_values = {'limit': 1, 'to_ts': 1600000000}
+    querystr = format_query_indentation(TEST_QUERY_1.format())
+
+    compiled = graph.compile(querystr, param_types)
+    assert graph.compile(querystr, param_types) is compiled
+
+    session = MagicMock()
+    session.post.return_value = _mock_response(expected_result)
+
+    with patch.object(graph, '_session', new=session):
+        assert compiled(param_values) == expected_result
         result = graph.query(
             querystr=querystr,
             param_types=param_types,
             param_values=param_values,
         )
 
-    assert client.execute.call_count == 1
     assert result == expected_result
+    assert session.post.call_count == 1  # query() was served from the shared cache
+
+
+def test_paginate():
+    """Test that paginate accumulates pages via id_gt keyset pagination until
+    a short page signals the end.
+    """
+    graph = Graph(TEST_URL_1)
+    querystr = format_query_indentation(TEST_QUERY_1.format())
+
+    session = MagicMock()
+    session.post.side_effect = [
+        _mock_response({'tokenDayDatas': [{'id': 'a'}, {'id': 'b'}]}),
+        _mock_response({'tokenDayDatas': [{'id': 'c'}]}),
+    ]
+
+    with patch.object(graph, '_session', new=session):
+        rows = graph.paginate(
+            querystr=querystr,
+            entity_name='tokenDayDatas',
+            param_types={'$limit': 'Int!'},
+            param_values={'limit': 2},
+            page_size=2,
+        )
+
+    assert rows == [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+    assert session.post.call_count == 2
+    _, kwargs = session.post.call_args
+    request_body = kwargs['json'] if 'json' in kwargs else json.loads(kwargs['data'])
+    assert request_body['variables']['last_id'] == 'b'  # cursor advanced to the last row
+
+
+def test_query_batch():
+    """Test that batched queries are aliased into a single request and that
+    the combined response is split back per sub-query.
+    """
+    graph = Graph(TEST_URL_1)
+    querystr = format_query_indentation(TEST_QUERY_1.format())
+
+    session = MagicMock()
+    session.post.return_value = _mock_response({
+        'q0': [{'date': 1}],
+        'q1': [{'date': 2}],
+    })
+
+    with patch.object(graph, '_session', new=session):
+        result = graph.query_batch([
+            (querystr, {'$limit': 'Int!'}, {'limit': 1}),
+            (querystr, {'$limit': 'Int!'}, {'limit': 2}),
+        ])
+
+    assert session.post.call_count == 1
+    assert result == [
+        {'tokenDayDatas': [{'date': 1}]},
+        {'tokenDayDatas': [{'date': 2}]},
+    ]
+    _, kwargs = session.post.call_args
+    # the body is given as pre-encoded bytes when orjson is available
+    request_body = kwargs['json'] if 'json' in kwargs else json.loads(kwargs['data'])
+    assert request_body['variables'] == {'q0_limit': 1, 'q1_limit': 2}
+
+
+def test_query_batch_without_params():
+    """Test that sub-queries given as complete documents (no param types, as
+    the ens and blocks subgraph callers build them) are unwrapped and batched.
+    """
+    graph = Graph(TEST_URL_1)
+
+    session = MagicMock()
+    session.post.return_value = _mock_response({
+        'q0': [{'labelName': 'foo'}],
+        'q1': [{'number': '1'}],
+    })
+
+    with patch.object(graph, '_session', new=session):
+        result = graph.query_batch([
+            ('query{domains(first:1, where:{labelhash:"0xdead"}){labelName}}', None, None),
+            ('{ blocks(first: 1) { number } }', None, None),
+        ])
+
+    assert session.post.call_count == 1
+    assert result == [
+        {'domains': [{'labelName': 'foo'}]},
+        {'blocks': [{'number': '1'}]},
+    ]
+    _, kwargs = session.post.call_args
+    request_body = kwargs['json'] if 'json' in kwargs else json.loads(kwargs['data'])
+    assert request_body['query'] == (
+        '{q0: domains(first:1, where:{labelhash:"0xdead"}){labelName} '
+        'q1: blocks(first: 1) { number }}'
+    )